@@ -1,133 +1,280 @@
 # imports
-from geopy.geocoders import Nominatim # type: ignore
-from geopy.extra.rate_limiter import RateLimiter # type: ignore
-from tqdm import tqdm # type: ignore
+import asyncio
+import json
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+import aiohttp # type: ignore
+import orjson # type: ignore
+from aiohttp_client_cache import CachedSession as AsyncCachedSession, SQLiteBackend # type: ignore
+from tqdm.asyncio import tqdm as atqdm # type: ignore
+import numpy as np # type: ignore
 import pandas as pd # type: ignore
-import requests # type: ignore
 
 """
 Este módulo proporciona funciones para obtener datos geográficos y realizar búsquedas de lugares
 usando la API de Foursquare. Incluye funciones para obtener coordenadas geográficas, extraer datos
-relevantes de diccionarios y convertir la información en DataFrames de Pandas.
+relevantes de las respuestas JSON y convertir la información en DataFrames de Pandas.
 
 Funciones:
 ----------
 - obtener_coordenadas(datos_input):
-    Obtiene las coordenadas (latitud y longitud) de una lista de municipios utilizando la
-    librería geopy para geocodificación. Devuelve un DataFrame con los nombres de los municipios,
-    latitudes y longitudes.
+    Obtiene las coordenadas (latitud y longitud) de una lista de municipios consultando la API
+    de Nominatim de forma concurrente, respetando el límite de 1 petición por segundo. Las
+    coordenadas se guardan en una caché en disco para no repetir consultas entre ejecuciones.
+    Devuelve un DataFrame con los nombres de los municipios, latitudes y longitudes.
 
-- extract_values_categoria(dictionary):
-    Extrae el ID de la categoría y el nombre de la categoría desde un diccionario. Devuelve una
-    tupla con el ID y el nombre.
-
-- extract_values_datos(dictionary):
-    Extrae la dirección formateada de un diccionario. Devuelve la dirección como cadena de texto.
-
-- extract_values_position(dictionary):
-    Extrae la latitud y longitud desde un diccionario de geocodificación. Devuelve la latitud y longitud.
-
-- extract_data_df(df, municipio):
-    Convierte un DataFrame con datos de la API en un formato limpio. Extrae las categorías, la
-    dirección, latitud y longitud de los registros, y asigna el nombre del municipio.
+- normalizar_lugares(resultados):
+    Convierte los resultados de la API en un DataFrame con pd.json_normalize. Extrae la categoría
+    principal, la dirección, latitud y longitud de cada lugar y deja solo las columnas relevantes.
 
 - get_data_places(municipio, categorias, distancia, latitud, longitud, token):
     Realiza una búsqueda de lugares en un municipio utilizando la API de Foursquare. Los resultados
-    se filtran por categorías y se limitan a un radio específico. Devuelve un DataFrame con los
+    se filtran por categorías y se limitan a un radio específico. Usa la misma caché y política de
+    reintentos que get_all_data, pero abre su propia conexión en cada llamada: es para consultas
+    sueltas, para muchos municipios hay que usar get_all_data. Devuelve un DataFrame con los
     resultados.
 
 - get_all_data(df, token):
-    Realiza búsquedas en múltiples municipios y categorías utilizando la API de Foursquare.
-    Devuelve un DataFrame consolidado con la información obtenida de las búsquedas.
+    Realiza búsquedas en múltiples municipios y categorías utilizando la API de Foursquare, con
+    una única petición por municipio que incluye todas las categorías. Si esa petición llega al
+    límite de 50 lugares, se repite una vez por categoría. Las peticiones se lanzan de forma
+    concurrente y se reintentan si la API devuelve un 429 o un error 5xx, con backoff exponencial
+    respetando Retry-After. Los municipios que fallan se avisan y se omiten sin perder el resto.
+    Las respuestas se guardan en una caché SQLite durante un día. Devuelve un DataFrame
+    consolidado con la información obtenida de las búsquedas.
 
 Constantes:
 -----------
 - lista_municipios:
-    Lista de municipios en los que se realizarán las búsquedas de lugares.
+    Tupla inmutable de municipios en los que se realizarán las búsquedas de lugares.
 
 Dependencias:
 -------------
-- geopy: Para la geocodificación de los municipios.
-- tqdm: Para mostrar una barra de progreso durante las iteraciones.
+- aiohttp: Para las peticiones concurrentes a las APIs de Nominatim y Foursquare.
+- orjson: Para decodificar rápidamente las respuestas JSON de Foursquare.
+- tqdm: Para mostrar una barra de progreso sobre el conjunto de peticiones concurrentes.
+- numpy: Para construir el DataFrame de coordenadas con tipos fijos.
 - pandas: Para la manipulación de datos.
-- requests: Para realizar solicitudes a la API de Foursquare.
+- aiohttp-client-cache: Para cachear las respuestas de Foursquare en disco.
 
 """
 
 # constantes
-lista_municipios = ['acebeda-la', 'ajalvir', 'alameda-del-valle', 'alamo-el', 'alcala-de-henares', 'alcobendas', 'alcorcon', 'aldea-del-fresno', 'algete', 'alpedrete', 'ambite', 'anchuelo', 'aranjuez', 'arganda-del-rey', 'arroyomolinos', 'atazar-el', 'batres', 'becerril-de-la-sierra', 'belmonte-de-tajo', 'berrueco-el', 'berzosa-del-lozoya', 'boadilla-del-monte', 'boalo-el', 'braojos', 'brea-de-tajo', 'brunete', 'buitrago-del-lozoya', 'bustarviejo', 'cabanillas-de-la-sierra', 'cabrera-la', 'cadalso-de-los-vidrios', 'camarma-de-esteruelas', 'campo-real', 'canencia', 'carabana', 'casarrubuelos', 'cenicientos', 'cercedilla', 'cervera-de-buitrago', 'chapineria', 'chinchon', 'ciempozuelos', 'cobena', 'collado-mediano', 'collado-villalba', 'colmenar-del-arroyo', 'colmenar-de-oreja', 'colmenarejo', 'colmenar-viejo', 'corpa', 'coslada', 'cubas-de-la-sagra', 'daganzo-de-arriba', 'escorial-el', 'estremera', 'fresnedillas-de-la-oliva', 'fresno-de-torote', 'fuenlabrada', 'fuente-el-saz-de-jarama', 'fuentiduena-de-tajo', 'galapagar', 'garganta-de-los-montes', 'gargantilla-del-lozoya-y-pinilla-de-buitrago', 'gascones', 'getafe', 'grinon', 'guadalix-de-la-sierra', 'guadarrama', 'hiruela-la', 'horcajo-de-la-sierra-aoslos', 'horcajuelo-de-la-sierra', 'hoyo-de-manzanares', 'humanes-de-madrid', 'leganes', 'loeches', 'lozoya', 'lozoyuela-navas-sieteiglesias', 'madarcos', 'madrid', 'majadahonda', 'manzanares-el-real', 'meco', 'mejorada-del-campo', 'miraflores-de-la-sierra', 'molar-el', 'molinos-los', 'montejo-de-la-sierra', 'moraleja-de-enmedio', 'moralzarzal', 'morata-de-tajuna', 'mostoles', 'navacerrada', 'navalafuente', 'navalagamella', 'navalcarnero', 'navarredonda-y-san-mames', 'navas-del-rey', 'nuevo-baztan', 'olmeda-de-las-fuentes', 'orusco-de-tajuna', 'paracuellos-de-jarama', 'parla', 'patones', 'pedrezuela', 'pelayos-de-la-presa', 'perales-de-tajuna', 'pezuela-de-las-torres', 'pinilla-del-valle', 'pinto', 'pinuecar-gandullas', 'pozuelo-de-alarcon', 'pozuelo-del-rey', 'pradena-del-rincon', 'puebla-de-la-sierra', 'puentes-viejas-manjiron', 'quijorna', 'rascafria', 'reduena', 'ribatejada', 'rivas-vaciamadrid', 'robledillo-de-la-jara', 'robledo-de-chavela', 'robregordo', 'rozas-de-madrid-las', 'rozas-de-puerto-real', 'san-agustin-del-guadalix', 'san-fernando-de-henares', 'san-lorenzo-de-el-escorial', 'san-martin-de-la-vega', 'san-martin-de-valdeiglesias', 'san-sebastian-de-los-reyes', 'santa-maria-de-la-alameda', 'santorcaz', 'santos-de-la-humosa-los', 'serna-del-monte-la', 'serranillos-del-valle', 'sevilla-la-nueva', 'somosierra', 'soto-del-real', 'talamanca-de-jarama', 'tielmes', 'titulcia', 'torrejon-de-ardoz', 'torrejon-de-la-calzada', 'torrejon-de-velasco', 'torrelaguna', 'torrelodones', 'torremocha-de-jarama', 'torres-de-la-alameda', 'tres-cantos', 'valdaracete', 'valdeavero', 'valdelaguna', 'valdemanco', 'valdemaqueda', 'valdemorillo', 'valdemoro', 'valdeolmos-alalpardo', 'valdepielagos', 'valdetorres-de-jarama', 'valdilecha', 'valverde-de-alcala', 'velilla-de-san-antonio', 'vellon-el', 'venturada', 'villaconejos', 'villa-del-prado', 'villalbilla', 'villamanrique-de-tajo', 'villamanta', 'villamantilla', 'villanueva-de-la-canada', 'villanueva-del-pardillo', 'villanueva-de-perales', 'villar-del-olmo', 'villarejo-de-salvanes', 'villaviciosa-de-odon', 'villavieja-del-lozoya', 'zarzalejo']
-
+URL_NOMINATIM = "https://nominatim.openstreetmap.org/search"
+HEADERS_NOMINATIM = {"User-Agent": "laboratorio-modulo3-leccion01-APIs"}
+ARTICULOS = ('el', 'la', 'los', 'las')
+MAX_REINTENTOS = 5
+ESTADOS_REINTENTO = {429, 500, 502, 503, 504}
+LIMITE_FOURSQUARE = 50
+TIMEOUT = aiohttp.ClientTimeout(total=10)
+RUTA_CACHE_COORDENADAS = os.path.join(os.path.dirname(__file__), "..", "datos", "coords_cache.json")
+RUTA_CACHE_FOURSQUARE = os.path.join(os.path.dirname(__file__), "..", "datos", "fsq_cache")
+EXPIRACION_CACHE_FOURSQUARE = timedelta(days=1)
+COLUMNAS_JSON = {
+    'location.formatted_address': 'direccion',
+    'geocodes.main.latitude': 'latitud',
+    'geocodes.main.longitude': 'longitud'
+}
+COLUMNAS_LUGARES = ['fsq_id', 'name', 'distance', 'municipio', 'id_categoria', 'categoria', 'direccion', 'latitud', 'longitud']
+
+lista_municipios = ('acebeda-la', 'ajalvir', 'alameda-del-valle', 'alamo-el', 'alcala-de-henares', 'alcobendas', 'alcorcon', 'aldea-del-fresno', 'algete', 'alpedrete', 'ambite', 'anchuelo', 'aranjuez', 'arganda-del-rey', 'arroyomolinos', 'atazar-el', 'batres', 'becerril-de-la-sierra', 'belmonte-de-tajo', 'berrueco-el', 'berzosa-del-lozoya', 'boadilla-del-monte', 'boalo-el', 'braojos', 'brea-de-tajo', 'brunete', 'buitrago-del-lozoya', 'bustarviejo', 'cabanillas-de-la-sierra', 'cabrera-la', 'cadalso-de-los-vidrios', 'camarma-de-esteruelas', 'campo-real', 'canencia', 'carabana', 'casarrubuelos', 'cenicientos', 'cercedilla', 'cervera-de-buitrago', 'chapineria', 'chinchon', 'ciempozuelos', 'cobena', 'collado-mediano', 'collado-villalba', 'colmenar-del-arroyo', 'colmenar-de-oreja', 'colmenarejo', 'colmenar-viejo', 'corpa', 'coslada', 'cubas-de-la-sagra', 'daganzo-de-arriba', 'escorial-el', 'estremera', 'fresnedillas-de-la-oliva', 'fresno-de-torote', 'fuenlabrada', 'fuente-el-saz-de-jarama', 'fuentiduena-de-tajo', 'galapagar', 'garganta-de-los-montes', 'gargantilla-del-lozoya-y-pinilla-de-buitrago', 'gascones', 'getafe', 'grinon', 'guadalix-de-la-sierra', 'guadarrama', 'hiruela-la', 'horcajo-de-la-sierra-aoslos', 'horcajuelo-de-la-sierra', 'hoyo-de-manzanares', 'humanes-de-madrid', 'leganes', 'loeches', 'lozoya', 'lozoyuela-navas-sieteiglesias', 'madarcos', 'madrid', 'majadahonda', 'manzanares-el-real', 'meco', 'mejorada-del-campo', 'miraflores-de-la-sierra', 'molar-el', 'molinos-los', 'montejo-de-la-sierra', 'moraleja-de-enmedio', 'moralzarzal', 'morata-de-tajuna', 'mostoles', 'navacerrada', 'navalafuente', 'navalagamella', 'navalcarnero', 'navarredonda-y-san-mames', 'navas-del-rey', 'nuevo-baztan', 'olmeda-de-las-fuentes', 'orusco-de-tajuna', 'paracuellos-de-jarama', 'parla', 'patones', 'pedrezuela', 'pelayos-de-la-presa', 'perales-de-tajuna', 'pezuela-de-las-torres', 'pinilla-del-valle', 'pinto', 'pinuecar-gandullas', 'pozuelo-de-alarcon', 'pozuelo-del-rey', 'pradena-del-rincon', 'puebla-de-la-sierra', 'puentes-viejas-manjiron', 'quijorna', 'rascafria', 'reduena', 'ribatejada', 'rivas-vaciamadrid', 'robledillo-de-la-jara', 'robledo-de-chavela', 'robregordo', 'rozas-de-madrid-las', 'rozas-de-puerto-real', 'san-agustin-del-guadalix', 'san-fernando-de-henares', 'san-lorenzo-de-el-escorial', 'san-martin-de-la-vega', 'san-martin-de-valdeiglesias', 'san-sebastian-de-los-reyes', 'santa-maria-de-la-alameda', 'santorcaz', 'santos-de-la-humosa-los', 'serna-del-monte-la', 'serranillos-del-valle', 'sevilla-la-nueva', 'somosierra', 'soto-del-real', 'talamanca-de-jarama', 'tielmes', 'titulcia', 'torrejon-de-ardoz', 'torrejon-de-la-calzada', 'torrejon-de-velasco', 'torrelaguna', 'torrelodones', 'torremocha-de-jarama', 'torres-de-la-alameda', 'tres-cantos', 'valdaracete', 'valdeavero', 'valdelaguna', 'valdemanco', 'valdemaqueda', 'valdemorillo', 'valdemoro', 'valdeolmos-alalpardo', 'valdepielagos', 'valdetorres-de-jarama', 'valdilecha', 'valverde-de-alcala', 'velilla-de-san-antonio', 'vellon-el', 'venturada', 'villaconejos', 'villa-del-prado', 'villalbilla', 'villamanrique-de-tajo', 'villamanta', 'villamantilla', 'villanueva-de-la-canada', 'villanueva-del-pardillo', 'villanueva-de-perales', 'villar-del-olmo', 'villarejo-de-salvanes', 'villaviciosa-de-odon', 'villavieja-del-lozoya', 'zarzalejo')
+
+
+def _ejecutar(coro):
+    # Jupyter ya tiene un event loop en marcha, en ese caso se ejecuta en otro hilo
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+async def _capturar(coro):
+    # cada tarea devuelve su excepción en lugar de lanzarla: un fallo no abandona al resto
+    try:
+        return await coro
+    except Exception as e:
+        return e
+
+async def _consulta_nominatim(session, params, sem):
+    # cada token se devuelve al segundo: como máximo 1 petición por segundo
+    await sem.acquire()
+    asyncio.get_running_loop().call_later(1.0, sem.release)
+
+    async with session.get(URL_NOMINATIM, params={**params, 'format': 'json', 'limit': 1}, headers=HEADERS_NOMINATIM) as response:
+        response.raise_for_status()
+        return await response.json()
+
+def _nombre_municipio(municipio):
+    # los slugs llevan el artículo al final: 'acebeda-la' -> 'La Acebeda'
+    partes = municipio.split('-')
+    if len(partes) > 1 and partes[-1] in ARTICULOS:
+        partes = partes[-1:] + partes[:-1]
+    return ' '.join(partes).title()
+
+async def _fetch(session, municipio, sem, cache):
+    # la consulta estructurada es más rápida y precisa; si no encuentra nada se usa texto libre
+    params = {'city': _nombre_municipio(municipio), 'state': 'Madrid', 'country': 'Spain'}
+    resultado = await _consulta_nominatim(session, params, sem)
+    if not resultado:
+        resultado = await _consulta_nominatim(session, {'q': municipio}, sem)
+
+    # se guarda en cuanto se resuelve; los municipios sin resultado se reintentan en la próxima ejecución
+    if not resultado:
+        return False
+    cache[municipio] = (float(resultado[0]['lat']), float(resultado[0]['lon']))
+    return True
+
+async def _obtener_coordenadas(datos_input, cache):
+    sem = asyncio.Semaphore(1)
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=64), timeout=TIMEOUT) as session:
+        tasks = [_capturar(_fetch(session, m, sem, cache)) for m in datos_input]
+        results = await atqdm.gather(*tasks, total=len(tasks))
+
+    # un 429/503, una página de error o un timeout no detiene al resto
+    fallidos = [m for m, r in zip(datos_input, results) if isinstance(r, Exception)]
+    if fallidos:
+        warnings.warn(f"No se han podido geocodificar, se reintentarán en la próxima ejecución: {', '.join(fallidos)}")
+
+    sin_resultado = [m for m, r in zip(datos_input, results) if r is False]
+    if sin_resultado:
+        warnings.warn(f"Nominatim no ha encontrado estos municipios: {', '.join(sin_resultado)}")
+
+def _leer_cache_coordenadas():
+    try:
+        with open(RUTA_CACHE_COORDENADAS) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
 
 def obtener_coordenadas(datos_input):
 
-    geolocator = Nominatim(user_agent="user_agent")
-    geocode = RateLimiter(geolocator.geocode, min_delay_seconds=1)
+    cache = _leer_cache_coordenadas()
+    pendientes = [m for m in dict.fromkeys(datos_input) if m not in cache]
 
-    list_datos = []
+    if pendientes:
+        # aunque la descarga falle a medias, lo ya geocodificado queda guardado
+        try:
+            _ejecutar(_obtener_coordenadas(pendientes, cache))
+        finally:
+            with open(RUTA_CACHE_COORDENADAS, 'w') as f:
+                json.dump(cache, f)
 
-    for i in datos_input:
-    #for i in tqdm(datos_input):
-        location = geocode(i)
-        datos_in = []
-        datos_in.append(i)
-        datos_in.append(location.latitude)
-        datos_in.append(location.longitude)
-        list_datos.append(datos_in)
+    arr = np.empty(len(datos_input), dtype=[('municipio', 'O'), ('latitud', 'f8'), ('longitud', 'f8')])
+    for i, m in enumerate(datos_input):
+        arr[i] = (m, *cache.get(m, (np.nan, np.nan)))
 
+    df = pd.DataFrame(arr)
 
-    df = pd.DataFrame(list_datos)
+    return df
 
-    df = df.rename(columns = {0: 'municipio', 
-                    1: 'latitud',
-                    2: 'longitud'})
+def normalizar_lugares(resultados):
+    df = pd.json_normalize(resultados).rename(columns=COLUMNAS_JSON)
 
-    return df
+    # json_normalize no entra en listas: la categoría principal es la primera del array
+    principales = [c[0] if isinstance(c, list) and c else {} for c in df.get('categories', [None] * len(df))]
+    df['id_categoria'] = [c.get('id') for c in principales]
+    df['categoria'] = [c.get('name') for c in principales]
 
-def extract_values_categoria(dictionary):
-    id_categoria = dictionary[0]['id']
-    categoria = dictionary[0]['name']
-    return id_categoria, categoria
+    return df.reindex(columns=COLUMNAS_LUGARES)
 
-def extract_values_datos(dictionary):
-    direccion = dictionary['formatted_address']
-    return direccion
 
-def extract_values_position(dictionary):
-    main = dictionary['main']
-    latitude = main['latitude']
-    longitude = main['longitude']
+def _parse_records(body, municipio):
+    return [{**r, 'municipio': municipio} for r in orjson.loads(body)['results']]
 
-    return latitude, longitude
+def _url_places(categorias, distancia, latitud, longitud):
+    return f"https://api.foursquare.com/v3/places/search?ll={latitud}%2C{longitud}&radius={distancia}&categories={categorias}&fields=fsq_id%2Cname%2Clocation%2Ccategories%2Cdistance%2Cgeocodes&sort=DISTANCE&limit={LIMITE_FOURSQUARE}"
 
-def extract_data_df(df, municipio):
-    df['municipio']=pd.DataFrame(columns=["municipio"])
-    df['municipio'] = municipio
+def get_data_places(municipio, categorias, distancia ,latitud, longitud, token):
+
+    return normalizar_lugares(_ejecutar(_get_data_places(municipio, categorias, distancia, latitud, longitud, token)))
+
+def _segundos_retry_after(valor, por_defecto):
+    # Retry-After puede venir en segundos o como fecha HTTP
+    if valor is None:
+        return por_defecto
     try:
-        df[['id_categoria', 'categoria']] = df['categories'].apply(lambda x: pd.Series(extract_values_categoria(x)))
-        df['direccion'] = df['location'].apply(lambda x: pd.Series(extract_values_datos(x)))
-        df[['latitud', 'longitud']] = df['geocodes'].apply(lambda x: pd.Series(extract_values_position(x)))
-        df = df.drop(['categories', 'location','geocodes'], axis=1)
-    except:
+        return float(valor)
+    except ValueError:
         pass
-    return df
+    try:
+        fecha = parsedate_to_datetime(valor)
+    except (TypeError, ValueError):
+        return por_defecto
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=timezone.utc)
+    return max(0.0, (fecha - datetime.now(timezone.utc)).total_seconds())
 
+async def _fetch_place(session, sem, municipio, cat, dist, lat, lon, token):
+
+    url = _url_places(cat, dist, lat, lon)
 
-def get_data_places(municipio, categorias, distancia ,latitud, longitud, token):
-    
-    url = f"https://api.foursquare.com/v3/places/search?ll={latitud}%2C{longitud}&radius={distancia}&categories={categorias}&fields=fsq_id%2Cname%2Clocation%2Ccategories%2Cdistance%2Cgeocodes&sort=DISTANCE&limit=50"
-    
     headers = {
         "accept": "application/json",
         "Authorization": token
     }
-    
-    response = requests.get(url, headers=headers)
-    resultado = response.json()
 
-    df = pd.DataFrame(resultado['results'])
+    espera = 1
+    for intento in range(MAX_REINTENTOS):
+        # el hueco del semáforo solo se ocupa durante la petición, no durante la espera
+        async with sem, session.get(url, headers=headers) as response:
+            if response.status not in ESTADOS_REINTENTO:
+                response.raise_for_status()
+                body = await response.read()
+                break
+            # 429/5xx: esperamos lo que indique la API o con backoff exponencial
+            espera = _segundos_retry_after(response.headers.get('Retry-After'), espera * 2)
+        if intento < MAX_REINTENTOS - 1:
+            await asyncio.sleep(espera)
+    else:
+        raise RuntimeError(f"Foursquare sigue devolviendo {response.status} para {municipio} ({cat})")
+
+    return _parse_records(body, municipio)
+
+async def _fetch_municipio(session, sem, municipio, categorias, dist, lat, lon, token):
+
+    # Foursquare acepta varias categorías separadas por comas: una sola petición por municipio
+    records = await _fetch_place(session, sem, municipio, ','.join(map(str, categorias)), dist, lat, lon, token)
+    if len(records) < LIMITE_FOURSQUARE or len(categorias) == 1:
+        return records
+
+    # la búsqueda conjunta se ha cortado en el límite: se repite por categoría para no perder lugares
+    records = []
+    for c in categorias:
+        records.extend(await _fetch_place(session, sem, municipio, c, dist, lat, lon, token))
+
+    return records
+
+def _sesion_foursquare():
+    connector = aiohttp.TCPConnector(limit_per_host=64)
+    cache = SQLiteBackend(RUTA_CACHE_FOURSQUARE, expire_after=EXPIRACION_CACHE_FOURSQUARE)
+    return AsyncCachedSession(cache=cache, connector=connector, timeout=TIMEOUT)
+
+async def _get_data_places(municipio, categorias, distancia, latitud, longitud, token):
+    async with _sesion_foursquare() as session:
+        return await _fetch_place(session, asyncio.Semaphore(1), municipio, categorias, distancia, latitud, longitud, token)
+
+async def _get_all_data(municipios, categorias, distancia, token):
+    sem = asyncio.Semaphore(64)
+    async with _sesion_foursquare() as session:
+        municipios = list(municipios)
+        tasks = [_capturar(_fetch_municipio(session, sem, municipio, categorias, distancia, lat, lon, token))
+                 for municipio, lat, lon in municipios]
+        results = await atqdm.gather(*tasks, total=len(tasks))
+
+    records = []
+    fallos = {}
+    for (municipio, _, _), r in zip(municipios, results):
+        if isinstance(r, Exception):
+            fallos[municipio] = r
+        else:
+            records.extend(r)
+
+    return normalizar_lugares(records), fallos
 
-    return extract_data_df(df,municipio)
- 
 def get_all_data(df,token):
 
     # Categorias seleccionadas
@@ -137,16 +284,18 @@ def get_all_data(df,token):
     # 17043	Retail > Fashion Retail > Clothing Store
     # 11006	Business and Professional Services > Audiovisual Service
 
-    lista_municip = df.values.tolist()
+    # sin coordenadas la API responde 400 y se perdería toda la descarga
+    sin_coordenadas = df[['latitud', 'longitud']].isna().any(axis=1)
+    if sin_coordenadas.any():
+        warnings.warn(f"Se omiten los municipios sin coordenadas: {', '.join(df.loc[sin_coordenadas, 'municipio'])}")
+
+    municipios = df.loc[~sin_coordenadas, ['municipio', 'latitud', 'longitud']].itertuples(index=False, name=None)
     distancia = 2000
     categoria = [16032,17114,13065,17043,11006]
-    result = []
-    df_final = pd.DataFrame(result)
-
-    for e in lista_municip:
-        #for c in tqdm(categoria):
-        for c in categoria:
-            df_temp = get_data_places(e[0],c,distancia,e[1],e[2],token)
-            df_final = pd.concat([df_temp, df_final], ignore_index=True)
-            
-    return pd.DataFrame(df_final)
\ No newline at end of file
+
+    df_final, fallos = _ejecutar(_get_all_data(municipios, categoria, distancia, token))
+    if fallos:
+        detalle = ', '.join(f"{m} ({type(e).__name__}: {e})" for m, e in fallos.items())
+        warnings.warn(f"No se han podido obtener lugares de {len(fallos)} municipios: {detalle}")
+
+    return df_final